@@ -3,6 +3,45 @@ import os
 import sys
 import datetime
 import argparse
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import pathname2url
+
+# Valid media file extensions. A tuple rather than a set, so it can be handed to
+# str.endswith as-is instead of being rebuilt with tuple() for every file.
+MEDIA_EXTENSIONS = (
+    '.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv',  # Video
+    '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', # Image
+    '.mp3', '.wav', '.flac', '.aac'                 # Audio
+)
+
+# Number of rows buffered before each executemany flush during the sync walk
+INSERT_BATCH_SIZE = 10000
+
+# Maximum number of walked paths buffered between the scanner threads and the DB writer
+WALK_QUEUE_SIZE = 10000
+
+# Progress lines are only written every N files; a write+flush per file is a syscall per file
+PROGRESS_INTERVAL = 500
+
+# Write buffer for the report logs, so a large miss list is flushed in a handful of syscalls
+LOG_BUFFER_SIZE = 1 << 20
+
+# Page cache for the attached, read-only stash.db (negative = KiB, so 128 MiB)
+STASH_CACHE_SIZE = -131072
+
+INSERT_SCAN_SQL = "INSERT OR IGNORE INTO temp.sync_scan (file_path) VALUES (?)"
+
+# Connection settings for the sync writer: WAL with synchronous=NORMAL avoids an fsync
+# per commit, and the 64 MiB page cache keeps the file_path index hot during bulk loads.
+LOCAL_DB_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-65536;
+    PRAGMA mmap_size=268435456;
+"""
 
 def create_local_db(db_path):
     """
@@ -10,135 +49,265 @@ def create_local_db(db_path):
     """
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
+    cursor.executescript(LOCAL_DB_PRAGMAS)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS local_files (
             local_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            file_path TEXT NOT NULL UNIQUE,
+            file_path TEXT NOT NULL,
             stash_file_id INTEGER NOT NULL
         );
     """)
+    # The query scripts filter local_files by stash_file_id
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_local_files_stash_file_id ON local_files(stash_file_id);")
     conn.commit()
     conn.close()
 
-def get_stash_files(stash_db_path):
+def is_utf8_path(path):
     """
-    Reads all file paths and IDs from the stash.db and returns them as a dictionary.
-    This is an in-memory lookup table to avoid multiple database queries.
+    True if path can be bound as SQLite text. os.scandir hands back a name that is not
+    valid UTF-8 as a surrogate-escaped str, which sqlite3 refuses to encode.
     """
-    stash_files = {}
+    if path.isascii():
+        return True
     try:
-        conn = sqlite3.connect(stash_db_path)
-        cursor = conn.cursor()
-
-        # Join files and folders to get the full path
-        cursor.execute("""
-            SELECT f.id, fl.path || '/' || f.basename
-            FROM files f
-            JOIN folders fl ON f.parent_folder_id = fl.id;
-        """)
-        
-        rows = cursor.fetchall()
-        for stash_id, full_path in rows:
-            # Normalize the path to match the filesystem's format
-            stash_files[os.path.normpath(full_path)] = stash_id
-        
-        conn.close()
-    except sqlite3.Error as e:
-        print(f"Error reading Stash DB: {e}")
-        return None
-    return stash_files
+        path.encode()
+    except UnicodeEncodeError:
+        return False
+    return True
 
-def get_file_count(filesystem_path):
+def attach_stash(conn, stash_db_path):
     """
-    Counts the number of media files in the specified directory tree.
+    Attaches stash.db read-only as the 'stash' schema and gives it its own page
+    cache. The connection must be opened with uri=True for the URI to be honored.
     """
-    count = 0
-    MEDIA_EXTENSIONS = {
-        '.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv',
-        '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff',
-        '.mp3', '.wav', '.flac', '.aac'
-    }
-    for dirpath, dirnames, filenames in os.walk(filesystem_path):
-        for filename in filenames:
-            if filename.lower().endswith(tuple(MEDIA_EXTENSIONS)):
-                count += 1
-    return count
-
-def sync_filesystem_with_stash(stash_db_path, local_db_path, filesystem_path):
+    stash_uri = f"file:{pathname2url(os.path.abspath(stash_db_path))}?mode=ro"
+    conn.execute("ATTACH DATABASE ? AS stash", (stash_uri,))
+    conn.execute(f"PRAGMA stash.cache_size={STASH_CACHE_SIZE};")
+
+def create_file_path_index(cursor):
     """
-    Scans the filesystem, verifies against stash.db, and populates the local database.
-    Logs missing files to a file in /tmp.
+    Builds the unique index on local_files.file_path once, after a bulk load.
+    Databases created while file_path carried a UNIQUE constraint already have
+    an equivalent autoindex, so nothing is added for them.
     """
-    # Define a set of valid media file extensions for faster lookup
-    MEDIA_EXTENSIONS = {
-        '.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv',  # Video
-        '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', # Image
-        '.mp3', '.wav', '.flac', '.aac'                 # Audio
-    }
+    cursor.execute("PRAGMA index_list(local_files);")
+    if not any(row[2] for row in cursor.fetchall()):
+        cursor.execute("CREATE UNIQUE INDEX idx_local_files_path ON local_files(file_path);")
 
-    create_local_db(local_db_path)
-    
-    print("Reading file paths from stash.db...")
-    stash_files = get_stash_files(stash_db_path)
-    if stash_files is None:
-        return
+def iter_matching_files(root, extensions):
+    """
+    Yields the path of every file under root whose name ends with one of the given
+    extensions. Uses os.scandir directly so the d_type returned by the directory read
+    answers is_dir() without a stat per entry. extensions must be a tuple of lowercase
+    suffixes. Unreadable directories are skipped, as os.walk does by default.
+    """
+    stack = [root]
+    while stack:
+        dirpath = stack.pop()
+        try:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(extensions):
+                        yield entry.path
+        except OSError:
+            continue
 
-    # Count the total number of files to process for the progress indicator
-    total_files = get_file_count(filesystem_path)
-    if total_files == 0:
-        print("No media files found to process.")
+def iter_matching_files_parallel(root, extensions, max_workers=None):
+    """
+    Same results as iter_matching_files, but every top-level subdirectory of root is
+    walked by a worker thread. os.scandir releases the GIL while it reads a directory,
+    so the directory-read latency of the subtrees overlaps. Paths come back to the
+    caller through a bounded queue, so all database work stays on the calling thread.
+    """
+    if max_workers is None:
+        max_workers = min(32, (os.cpu_count() or 1) * 4)
+
+    subdirs = []
+    try:
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith(extensions):
+                    yield entry.path
+    except OSError:
         return
 
-    # Connect to the local database
-    local_conn = sqlite3.connect(local_db_path)
+    results = queue.Queue(maxsize=WALK_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def walk_subtree(subdir):
+        try:
+            for path in iter_matching_files(subdir, extensions):
+                if stop.is_set():
+                    return
+                results.put(path)
+        finally:
+            # None marks this subtree as finished
+            results.put(None)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(walk_subtree, subdir) for subdir in subdirs]
+        remaining = len(futures)
+        try:
+            while remaining:
+                path = results.get()
+                if path is None:
+                    remaining -= 1
+                else:
+                    yield path
+            for future in futures:
+                future.result()
+        finally:
+            # If the caller stopped early, drain the queue so no worker stays blocked on put()
+            stop.set()
+            while remaining:
+                if results.get() is None:
+                    remaining -= 1
+
+def sync_filesystem_with_stash(stash_db_path, local_db_path, filesystem_path, workers=None):
+    """
+    Scans the filesystem, verifies against the attached stash.db, and populates the local database.
+    Logs missing files to a file in /tmp.
+    """
+    create_local_db(local_db_path)
+    
+    # Connect to the local database. isolation_level=None disables the implicit
+    # transaction handling so the whole scan runs in one explicit BEGIN/COMMIT.
+    local_conn = sqlite3.connect(local_db_path, isolation_level=None, uri=True)
     local_cursor = local_conn.cursor()
+    local_cursor.executescript(LOCAL_DB_PRAGMAS)
+
+    # Attach stash.db so scanned paths are matched against its files/folders tables
+    # inside SQLite. Stash paths get the same normalization as the filesystem side.
+    local_conn.create_function("normpath", 1, os.path.normpath, deterministic=True)
+    try:
+        attach_stash(local_conn, stash_db_path)
+    except sqlite3.Error as e:
+        print(f"Error reading Stash DB: {e}")
+        local_conn.close()
+        return
 
     log_file_path = "/tmp/stash_missing_files.log"
     print(f"Scanning filesystem from {filesystem_path}...")
     print(f"Missing files will be logged to {log_file_path}")
     
-    found_count = 0
-    missing_count = 0
     processed_count = 0
 
-    # Open the log file in write mode, overwriting it each time
-    with open(log_file_path, 'w') as log_file:
-        log_file.write(f"--- Missing Files Report - {datetime.datetime.now()} ---\n\n")
-
-        # Walk the filesystem to find files
-        for dirpath, dirnames, filenames in os.walk(filesystem_path):
-            for filename in filenames:
-                # Use the refined file extension check
-                if not filename.lower().endswith(tuple(MEDIA_EXTENSIONS)):
-                    continue
-                
-                full_path = os.path.normpath(os.path.join(dirpath, filename))
-                
-                # Check if this file exists in our in-memory Stash lookup table
-                if full_path in stash_files:
-                    stash_id = stash_files[full_path]
-                    
-                    # Insert the record into the local_files table
-                    try:
-                        local_cursor.execute(
-                            "INSERT INTO local_files (file_path, stash_file_id) VALUES (?, ?)",
-                            (full_path, stash_id)
-                        )
-                        found_count += 1
-                    except sqlite3.IntegrityError:
-                        # This file is already in our local database
-                        pass
-                else:
-                    # Write the missing file path to the log file
-                    log_file.write(f"{full_path}\n")
-                    missing_count += 1
-                
-                processed_count += 1
-                percentage = (processed_count / total_files) * 100
-                sys.stdout.write(f'\rProgress: {percentage:.2f}% ({processed_count}/{total_files} files)')
-                sys.stdout.flush()
+    # Every scanned path is bulk-loaded into a temp table and the matched files are
+    # merged into local_files after the walk, so the file_path index is probed once
+    # per file at the end rather than updated on every insert.
+    local_cursor.execute("CREATE TEMP TABLE sync_scan (file_path TEXT PRIMARY KEY);")
+
+    # Rows waiting to be flushed to the scan table with a single executemany
+    pending = []
+
+    # Paths that are not valid UTF-8 cannot be staged (or match a Stash path), so they
+    # go straight to the missing-files log
+    undecodable_paths = []
+
+    # One transaction for the whole walk: N inserts share a single journal sync
+    local_conn.execute("BEGIN")
+
+    # Walk the filesystem to find files
+    # Normalizing the root once is enough: scandir joins plain entry names onto it,
+    # so every entry.path below is already in normpath form.
+    for file_path in iter_matching_files_parallel(os.path.normpath(filesystem_path), MEDIA_EXTENSIONS, workers):
+        if is_utf8_path(file_path):
+            pending.append((file_path,))
+        else:
+            undecodable_paths.append(file_path)
+
+        if len(pending) >= INSERT_BATCH_SIZE:
+            local_cursor.executemany(INSERT_SCAN_SQL, pending)
+            pending.clear()
+        
+        processed_count += 1
+        if processed_count % PROGRESS_INTERVAL == 0:
+            sys.stdout.write(f'\rProcessed: {processed_count} files')
+            sys.stdout.flush()
+
+    sys.stdout.write(f'\rProcessed: {processed_count} files')
+    sys.stdout.flush()
+
+    if processed_count == 0:
+        print("\nNo media files found to process.")
+        local_conn.close()
+        return
+
+    if pending:
+        local_cursor.executemany(INSERT_SCAN_SQL, pending)
+
+    print("\nMatching scanned files against stash.db...")
+    try:
+        # The scan table is probed through its primary key once per stash file.
+        # OR REPLACE keeps the last stash id for a path, as the old dict lookup did.
+        # Only paths with a doubled or trailing slash or a dot component can change under normpath,
+        # so the Python callback is skipped for the (usual) already-clean rows.
+        local_cursor.execute("""
+            CREATE TEMP TABLE sync_matched (
+                file_path TEXT PRIMARY KEY,
+                stash_file_id INTEGER NOT NULL
+            );
+        """)
+        local_cursor.execute("""
+            INSERT OR REPLACE INTO sync_matched (file_path, stash_file_id)
+            SELECT s.file_path, sp.id
+            FROM (
+                SELECT f.id, fl.path || '/' || f.basename AS path
+                FROM stash.files f
+                JOIN stash.folders fl ON f.parent_folder_id = fl.id
+            ) sp
+            JOIN sync_scan s ON s.file_path = CASE
+                WHEN INSTR(sp.path, '//') OR INSTR(sp.path, '/.')
+                    OR SUBSTR(sp.path, 1, 1) = '.' OR SUBSTR(sp.path, -1) = '/'
+                THEN normpath(sp.path)
+                ELSE sp.path
+            END;
+        """)
+    except sqlite3.Error as e:
+        print(f"Error reading Stash DB: {e}")
+        local_conn.close()
+        return
+
+    # Write the missing file paths to the log file, overwriting it each time
+    local_cursor.execute("""
+        SELECT s.file_path
+        FROM sync_scan s
+        WHERE NOT EXISTS (SELECT 1 FROM sync_matched m WHERE m.file_path = s.file_path);
+    """)
+
+    # Stream the misses straight from the cursor into the buffered log instead of
+    # materializing them as a list first. The log is binary and each path goes through
+    # os.fsencode, which skips the text layer and writes the undecodable names from the
+    # walk back out as their original bytes.
+    missing_count = 0
+    with open(log_file_path, 'wb', buffering=LOG_BUFFER_SIZE) as log_file:
+        log_file.write(f"--- Missing Files Report - {datetime.datetime.now()} ---\n\n".encode())
+        for full_path in undecodable_paths:
+            log_file.write(os.fsencode(full_path) + b"\n")
+            missing_count += 1
+        for (full_path,) in local_cursor:
+            log_file.write(os.fsencode(full_path) + b"\n")
+            missing_count += 1
+
+    # Merge the matches, skipping files already in our local database
+    local_cursor.execute("""
+        INSERT INTO local_files (file_path, stash_file_id)
+        SELECT m.file_path, m.stash_file_id
+        FROM sync_matched m
+        WHERE NOT EXISTS (SELECT 1 FROM local_files lf WHERE lf.file_path = m.file_path);
+    """)
+    found_count = local_cursor.rowcount
+    create_file_path_index(local_cursor)
+
+    # Refresh the planner statistics now that the bulk load is done. Only the main
+    # schema is analyzed; stash.db is attached read-only.
+    local_cursor.execute("ANALYZE main;")
     
-    local_conn.commit()
+    local_conn.execute("COMMIT")
     local_conn.close()
     
     print("\n\nSync complete!")
@@ -163,10 +332,18 @@ if __name__ == "__main__":
         "filesystem_root",
         help="The root directory of the media library to scan."
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of directory-scanning threads (default: 4 per CPU, at most 32)."
+    )
     args = parser.parse_args()
 
     if not os.path.isdir(args.filesystem_root):
         print(f"Error: Filesystem root '{args.filesystem_root}' is not a valid directory.")
         sys.exit(1)
+    if args.workers is not None and args.workers < 1:
+        print("Error: --workers must be at least 1.")
+        sys.exit(1)
 
-    sync_filesystem_with_stash(stash_db_path, local_db_path, args.filesystem_root)
\ No newline at end of file
+    sync_filesystem_with_stash(stash_db_path, local_db_path, args.filesystem_root, args.workers)
\ No newline at end of file
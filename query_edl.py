@@ -4,147 +4,194 @@ import sys
 import argparse
 import datetime
 import re
+import random
+import functools
+from urllib.request import pathname2url
 
-def get_stash_scenes_by_tag(conn, tag_names):
-    """Queries stash.db for scene IDs associated with a list of tag names."""
-    cursor = conn.cursor()
-    where_clauses = [f"T1.name LIKE ?" for _ in tag_names]
-    where_clause = " OR ".join(where_clauses)
-    
-    params = [f"%{name}%" for name in tag_names]
+# Read-side settings applied once when the cached query connection is opened
+QUERY_DB_PRAGMAS = """
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-65536;
+    PRAGMA mmap_size=268435456;
+"""
 
-    query = f"""
-    SELECT T2.scene_id
-    FROM tags T1
-    JOIN scenes_tags T2 ON T1.id = T2.tag_id
-    WHERE {where_clause};
+# Page cache for the attached, read-only stash.db (negative = KiB, so 128 MiB)
+STASH_CACHE_SIZE = -131072
+
+# Sampled record IDs are fetched in chunks that stay under SQLite's default 999 bound-variable limit
+SAMPLE_FETCH_CHUNK = 900
+
+def attach_stash(conn, stash_db_path):
     """
-    cursor.execute(query, params)
-    return [row[0] for row in cursor.fetchall()]
-
-def get_stash_scenes_by_performer(conn, performer_names):
-    """Queries stash.db for scene IDs associated with a list of performer names."""
-    cursor = conn.cursor()
-    where_clauses = [f"T1.name LIKE ?" for _ in performer_names]
-    where_clause = " OR ".join(where_clauses)
-    
-    params = [f"%{name}%" for name in performer_names]
+    Attaches stash.db read-only as the 'stash' schema and gives it its own page
+    cache. The connection must be opened with uri=True for the URI to be honored.
+    """
+    stash_uri = f"file:{pathname2url(os.path.abspath(stash_db_path))}?mode=ro"
+    conn.execute("ATTACH DATABASE ? AS stash", (stash_uri,))
+    conn.execute(f"PRAGMA stash.cache_size={STASH_CACHE_SIZE};")
+
+@functools.lru_cache(maxsize=None)
+def get_connection(local_db_path, stash_db_path=None):
+    """
+    Opens the sync database once per process, applies the read PRAGMAs and, when
+    a stash path is given, attaches stash.db read-only as the 'stash' schema.
+    Later calls with the same paths reuse the open connection.
+    """
+    conn = sqlite3.connect(local_db_path, uri=True)
+    conn.executescript(QUERY_DB_PRAGMAS)
+    if stash_db_path:
+        attach_stash(conn, stash_db_path)
+    return conn
+
+def sample_edl_records(cursor, record_ids_query, params, limit, seed=None):
+    """
+    Samples up to `limit` clips from the record IDs selected by record_ids_query and
+    fetches the clip rows for just those IDs, in sampled order. Only the narrow ID
+    column is read for every candidate; ORDER BY RANDOM() would sort them all.
+    A seed makes the sample, and so the generated EDL, reproducible. A negative limit
+    means no limit, as it did for the old SQL LIMIT: every clip, in random order.
+    """
+    cursor.execute(record_ids_query, params)
+    record_ids = [row[0] for row in cursor]
+    sample_size = len(record_ids) if limit < 0 else min(limit, len(record_ids))
+    sampled_ids = random.Random(seed).sample(record_ids, sample_size)
+
+    clips = {}
+    for i in range(0, len(sampled_ids), SAMPLE_FETCH_CHUNK):
+        chunk = sampled_ids[i:i + SAMPLE_FETCH_CHUNK]
+        cursor.execute(f"""
+            SELECT T1.record_id, T2.file_path, T1.start_time_ms, T1.length_ms
+            FROM edl_records T1
+            JOIN local_files T2 ON T1.local_file_id = T2.local_id
+            WHERE T1.record_id IN ({','.join(['?'] * len(chunk))});
+        """, chunk)
+        for record_id, file_path, start_ms, length_ms in cursor:
+            clips[record_id] = (file_path, start_ms, length_ms)
+
+    return [clips[record_id] for record_id in sampled_ids]
+
+def format_ms(ms):
+    """
+    Formats a stored millisecond value as EDL seconds, e.g. 1500.0 -> '1.500'.
+    Whole milliseconds use integer math; anything finer keeps the full ms / 1000 value.
+    """
+    if not float(ms).is_integer():
+        return str(ms / 1000)
+    ms = int(ms)
+    return f"{ms // 1000}.{ms % 1000:03d}"
+
+def write_edl(output_file, edl_records):
+    """Writes the header and all (file_path, start_ms, length_ms) clips with a single write."""
+    lines = [f"{file_path},{format_ms(start_ms)},{format_ms(length_ms)}\n" for file_path, start_ms, length_ms in edl_records]
+    with open(output_file, 'w') as f:
+        f.write("# mpv EDL v0\n" + "".join(lines))
+
+def name_patterns(names):
+    """
+    Builds a VALUES row list with one '%name%' LIKE pattern per name. Joining the
+    names against it scans the name table once, however many names are given,
+    instead of once per OR'd LIKE clause.
+    """
+    values = ",".join(["(?)"] * len(names))
+    params = [f"%{name}%" for name in names]
+    return values, params
+
+def file_ids_query_by_tag(tag_names):
+    """Builds the SQL selecting the file IDs of Stash scenes associated with a list of tag names."""
+    values, params = name_patterns(tag_names)
 
     query = f"""
-    SELECT T2.scene_id
-    FROM performers T1
-    JOIN performers_scenes T2 ON T1.id = T2.performer_id
-    WHERE {where_clause};
+    WITH patterns(p) AS (VALUES {values})
+    SELECT sf.file_id
+    FROM stash.tags T1
+    JOIN patterns ON T1.name LIKE patterns.p
+    JOIN stash.scenes_tags T2 ON T1.id = T2.tag_id
+    JOIN stash.scenes_files sf ON sf.scene_id = T2.scene_id
     """
-    cursor.execute(query, params)
-    return [row[0] for row in cursor.fetchall()]
-
-def get_stash_scenes_by_studio(conn, studio_names):
-    """Queries stash.db for scene IDs associated with a list of studio names."""
-    cursor = conn.cursor()
-    where_clauses = [f"T1.name LIKE ?" for _ in studio_names]
-    where_clause = " OR ".join(where_clauses)
-    
-    params = [f"%{name}%" for name in studio_names]
+    return query, params
+
+def file_ids_query_by_performer(performer_names):
+    """Builds the SQL selecting the file IDs of Stash scenes associated with a list of performer names."""
+    values, params = name_patterns(performer_names)
 
     query = f"""
-    SELECT T2.id
-    FROM studios T1
-    JOIN scenes T2 ON T1.id = T2.studio_id
-    WHERE {where_clause};
+    WITH patterns(p) AS (VALUES {values})
+    SELECT sf.file_id
+    FROM stash.performers T1
+    JOIN patterns ON T1.name LIKE patterns.p
+    JOIN stash.performers_scenes T2 ON T1.id = T2.performer_id
+    JOIN stash.scenes_files sf ON sf.scene_id = T2.scene_id
     """
-    cursor.execute(query, params)
-    return [row[0] for row in cursor.fetchall()]
-
-def get_stash_file_id_by_scene_id(conn, scene_id):
-    """Queries stash.db for file IDs associated with a given scene ID."""
-    cursor = conn.cursor()
-    query = """
-    SELECT file_id
-    FROM scenes_files
-    WHERE scene_id = ?;
+    return query, params
+
+def file_ids_query_by_studio(studio_names):
+    """Builds the SQL selecting the file IDs of Stash scenes associated with a list of studio names."""
+    values, params = name_patterns(studio_names)
+
+    query = f"""
+    WITH patterns(p) AS (VALUES {values})
+    SELECT sf.file_id
+    FROM stash.studios T1
+    JOIN patterns ON T1.name LIKE patterns.p
+    JOIN stash.scenes T2 ON T1.id = T2.studio_id
+    JOIN stash.scenes_files sf ON sf.scene_id = T2.id
     """
-    cursor.execute(query, (scene_id,))
-    return [row[0] for row in cursor.fetchall()]
+    return query, params
 
-def generate_edl_by_stash(stash_db_path, local_db_path, query_type, query_values, limit, output_file):
+def generate_edl_by_stash(stash_db_path, local_db_path, query_type, query_values, limit, output_file, seed=None):
     """
     Queries stash.db for scenes based on metadata and generates an EDL.
+    stash.db is attached to the local connection so the metadata filter,
+    the scene-to-file resolution and the EDL lookup run as a single query.
     """
     try:
-        stash_conn = sqlite3.connect(stash_db_path)
-        local_conn = sqlite3.connect(local_db_path)
+        local_conn = get_connection(local_db_path, stash_db_path)
     except sqlite3.Error as e:
         print(f"Error connecting to databases: {e}", file=sys.stderr)
         return
 
-    # 1. Get Scene IDs from Stash DB based on the query type
-    scene_ids = set()
+    # 1. Build the Stash file ID selection based on the query type
     if query_type == 'tag':
-        scene_ids.update(get_stash_scenes_by_tag(stash_conn, query_values))
+        file_ids_query, params = file_ids_query_by_tag(query_values)
     elif query_type == 'performer':
-        scene_ids.update(get_stash_scenes_by_performer(stash_conn, query_values))
+        file_ids_query, params = file_ids_query_by_performer(query_values)
     elif query_type == 'studio':
-        scene_ids.update(get_stash_scenes_by_studio(stash_conn, query_values))
-
-    if not scene_ids:
-        print(f"No scenes found for {query_type} '{query_values}'.", file=sys.stderr)
-        stash_conn.close()
-        local_conn.close()
-        return
+        file_ids_query, params = file_ids_query_by_studio(query_values)
 
-    # 2. Get Stash File IDs from the Scene IDs
-    stash_file_ids = set()
-    for scene_id in scene_ids:
-        file_ids = get_stash_file_id_by_scene_id(stash_conn, scene_id)
-        stash_file_ids.update(file_ids)
-
-    if not stash_file_ids:
-        print(f"No video files found for the selected scenes.", file=sys.stderr)
-        stash_conn.close()
-        local_conn.close()
-        return
-
-    # 3. Get EDL records from our local DB
+    # 2. Get EDL records from our local DB. IN (subquery) lets SQLite dedupe the
+    # file IDs itself, so a file matching several names is only counted once.
     local_cursor = local_conn.cursor()
     
-    stash_file_ids_tuple = tuple(stash_file_ids)
-    
     query = f"""
-    SELECT T2.file_path, T1.start_time_ms / 1000.0, T1.length_ms / 1000.0
+    SELECT T1.record_id
     FROM edl_records T1
     JOIN local_files T2 ON T1.local_file_id = T2.local_id
-    WHERE T2.stash_file_id IN ({','.join(['?'] * len(stash_file_ids_tuple))})
-    ORDER BY RANDOM()
-    LIMIT {limit};
+    WHERE T2.stash_file_id IN ({file_ids_query});
     """
-    local_cursor.execute(query, stash_file_ids_tuple)
-    
-    edl_records = local_cursor.fetchall()
-    
-    stash_conn.close()
-    local_conn.close()
+    edl_records = sample_edl_records(local_cursor, query, params, limit, seed)
 
     if not edl_records:
-        print(f"No EDL records found linked to the selected Stash metadata.", file=sys.stderr)
+        print(f"No EDL records found linked to the selected Stash metadata for {query_type} '{query_values}'.", file=sys.stderr)
         return
 
-    # 4. Generate the EDL output
-    with open(output_file, 'w') as f:
-        f.write("# mpv EDL v0\n")
-        for file_path, start_time, length in edl_records:
-            f.write(f"{file_path},{start_time},{length}\n")
+    # 3. Generate the EDL output
+    write_edl(output_file, edl_records)
     
     print(f"EDL generated and saved to {output_file}", file=sys.stderr)
     print(f'export QEOL="{output_file}"')
 
 
-def generate_edl_by_edl_filename(local_db_path, edl_filenames, limit, output_file):
+def has_edl_files_fts(cursor):
+    """Returns True when the sync DB carries the trigram FTS index over EDL filenames."""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'edl_files_fts';")
+    return cursor.fetchone() is not None
+
+def generate_edl_by_edl_filename(local_db_path, edl_filenames, limit, output_file, seed=None):
     """
     Queries sync.db for EDL records based on a list of filenames and generates an EDL.
     """
     try:
-        local_conn = sqlite3.connect(local_db_path)
+        local_conn = get_connection(local_db_path)
         local_cursor = local_conn.cursor()
     except sqlite3.Error as e:
         print(f"Error connecting to local database: {e}", file=sys.stderr)
@@ -157,30 +204,31 @@ def generate_edl_by_edl_filename(local_db_path, edl_filenames, limit, output_fil
         else:
             filename_patterns.append(f'%{filename}%')
             
-    where_clauses = ['T2.filename LIKE ?'] * len(filename_patterns)
-    where_clause = ' OR '.join(where_clauses)
+    # Each pattern probes the trigram FTS index over edl_files when the sync DB has one,
+    # otherwise edl_files is scanned once against all patterns. The IN keeps an EDL file
+    # that matches several patterns from contributing its records more than once.
+    values = ','.join(['(?)'] * len(filename_patterns))
+    filename_source = "edl_files_fts" if has_edl_files_fts(local_cursor) else "edl_files"
 
     query = f"""
-    SELECT T3.file_path, T1.start_time_ms / 1000.0, T1.length_ms / 1000.0
+    WITH names(n) AS (VALUES {values})
+    SELECT T1.record_id
     FROM edl_records T1
-    JOIN edl_files T2 ON T1.edl_id = T2.edl_id
     JOIN local_files T3 ON T1.local_file_id = T3.local_id
-    WHERE {where_clause}
-    ORDER BY RANDOM()
-    LIMIT {limit};
+    WHERE T1.edl_id IN (
+        SELECT T2.rowid
+        FROM names
+        CROSS JOIN {filename_source} T2
+        WHERE T2.filename LIKE names.n
+    );
     """
-    local_cursor.execute(query, filename_patterns)
-    edl_records = local_cursor.fetchall()
-    local_conn.close()
+    edl_records = sample_edl_records(local_cursor, query, filename_patterns, limit, seed)
 
     if not edl_records:
         print(f"No EDL records found for filenames '{edl_filenames}'.", file=sys.stderr)
         return
 
-    with open(output_file, 'w') as f:
-        f.write("# mpv EDL v0\n")
-        for file_path, start_time, length in edl_records:
-            f.write(f"{file_path},{start_time},{length}\n")
+    write_edl(output_file, edl_records)
 
     print(f"EDL generated and saved to {output_file}", file=sys.stderr)
     print(f'export QEOL="{output_file}"')
@@ -216,12 +264,14 @@ if __name__ == "__main__":
     group.add_argument('--performer', nargs='+', help="Filter by Stash performer names (partial matching).")
     group.add_argument('--studio', nargs='+', help="Filter by Stash studio names (partial matching).")
     stash_parser.add_argument('--limit', type=int, default=400, help="Maximum number of records to return (default: 400).")
+    stash_parser.add_argument('--seed', type=int, help="Seed for the random clip selection, to reproduce an earlier EDL.")
     stash_parser.add_argument('--output', help="Output filename for the EDL. Overwrites existing file.")
 
     # Subparser for the 'by_edl' mode
     edl_parser = subparsers.add_parser('by_edl', help='Query based on EDL filename.')
     edl_parser.add_argument('--filename', nargs='+', required=True, help="Filter by one or more EDL filenames (partial matching).")
     edl_parser.add_argument('--limit', type=int, default=400, help="Maximum number of records to return (default: 400).")
+    edl_parser.add_argument('--seed', type=int, help="Seed for the random clip selection, to reproduce an earlier EDL.")
     edl_parser.add_argument('--output', help="Output filename for the EDL. Overwrites existing file.")
 
     args = parser.parse_args()
@@ -268,11 +318,11 @@ if __name__ == "__main__":
 
     if args.mode == 'by_stash':
         if args.tag:
-            generate_edl_by_stash(stash_db_path, local_db_path, 'tag', args.tag, args.limit, output_file_path)
+            generate_edl_by_stash(stash_db_path, local_db_path, 'tag', args.tag, args.limit, output_file_path, args.seed)
         elif args.performer:
-            generate_edl_by_stash(stash_db_path, local_db_path, 'performer', args.performer, args.limit, output_file_path)
+            generate_edl_by_stash(stash_db_path, local_db_path, 'performer', args.performer, args.limit, output_file_path, args.seed)
         elif args.studio:
-            generate_edl_by_stash(stash_db_path, local_db_path, 'studio', args.studio, args.limit, output_file_path)
+            generate_edl_by_stash(stash_db_path, local_db_path, 'studio', args.studio, args.limit, output_file_path, args.seed)
     
     elif args.mode == 'by_edl':
-        generate_edl_by_edl_filename(local_db_path, args.filename, args.limit, output_file_path)
\ No newline at end of file
+        generate_edl_by_edl_filename(local_db_path, args.filename, args.limit, output_file_path, args.seed)
\ No newline at end of file
@@ -3,7 +3,74 @@ import os
 import sys
 import datetime
 import argparse
+import queue
+import threading
 import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import pathname2url
+
+# Media file suffixes matched by the sync walk. A tuple rather than a set, so it can be
+# handed to str.endswith as-is instead of being rebuilt with tuple() for every file.
+MEDIA_EXTENSIONS = ('.mp4', '.mkv', '.avi', '.mov', '.wmv', '.webm', '.flv', '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.mp3', '.wav', '.flac', '.aac')
+EDL_EXTENSIONS = ('.edl',)
+
+# Number of rows buffered before each executemany flush during the sync walk
+INSERT_BATCH_SIZE = 10000
+
+# Maximum number of walked paths buffered between the scanner threads and the DB writer
+WALK_QUEUE_SIZE = 10000
+
+# Threads reading EDL files during ingest. Parsing holds the GIL, so only the file reads
+# overlap; a few threads are enough to hide that latency.
+EDL_PARSE_WORKERS = 4
+
+# Progress lines are only written every N files; a write+flush per file is a syscall per file
+PROGRESS_INTERVAL = 500
+
+# Write buffer for the report logs, so a large miss list is flushed in a handful of syscalls
+LOG_BUFFER_SIZE = 1 << 20
+
+# Extra settings while --rebuild bulk-loads a freshly created database. Durability
+# does not matter there: an interrupted rebuild is simply run again. They are scoped
+# to main because unqualified they also apply to stash.db when it is attached, and a
+# WAL-mode stash.db cannot be opened read-only in exclusive locking mode.
+REBUILD_DB_PRAGMAS = """
+    PRAGMA main.journal_mode=OFF;
+    PRAGMA main.synchronous=OFF;
+    PRAGMA main.locking_mode=EXCLUSIVE;
+"""
+
+# Page cache for the attached, read-only stash.db (negative = KiB, so 128 MiB)
+STASH_CACHE_SIZE = -131072
+
+INSERT_SCAN_SQL = "INSERT OR IGNORE INTO temp.sync_scan (file_path) VALUES (?)"
+INSERT_EDL_FILE_SQL = "INSERT INTO edl_files (filename, ingested_at) VALUES (?, ?) RETURNING edl_id"
+INSERT_EDL_METADATA_SQL = "INSERT OR IGNORE INTO edl_metadata (edl_id, style) VALUES (?, ?)"
+INSERT_EDL_STAGING_SQL = """INSERT INTO temp.edl_staging (edl_path, line_number, edl_id, file_path, start_time_ms, length_ms)
+    VALUES (?, ?, ?, ?, ?, ?)"""
+# INSERT OR IGNORE is the core of the incremental update logic for re-ingested EDLs too
+LINK_EDL_STAGING_SQL = """INSERT OR IGNORE INTO edl_records (edl_id, local_file_id, start_time_ms, length_ms)
+    SELECT s.edl_id, lf.local_id, s.start_time_ms, s.length_ms
+    FROM temp.edl_staging s
+    JOIN local_files lf ON lf.file_path = s.file_path
+    ORDER BY s.rowid"""
+
+# Size of each connection's prepared-statement cache (sqlite3 defaults to 128)
+CACHED_STATEMENTS = 256
+
+# Split-file suffix stripped from an EDL filename to get its style name
+CHOPPED_SUFFIX_RE = re.compile(r'_chopped\d-\d$')
+
+# Connection settings for the sync writer: WAL with synchronous=NORMAL avoids an fsync
+# per commit, and the 64 MiB page cache keeps the file_path index hot during bulk loads.
+LOCAL_DB_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-65536;
+    PRAGMA mmap_size=268435456;
+"""
 
 # ----------------------------------------------------------------------------------------------------------------------
 # DATABASE STRUCTURE
@@ -12,16 +79,19 @@ import re
 def create_local_db(conn):
     """
     Creates the local_files, edl_files, edl_records, and edl_metadata tables
-    in the provided database connection.
+    in the provided database connection and applies the writer PRAGMAs.
     """
     cursor = conn.cursor()
+    cursor.executescript(LOCAL_DB_PRAGMAS)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS local_files (
             local_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            file_path TEXT NOT NULL UNIQUE,
+            file_path TEXT NOT NULL,
             stash_file_id INTEGER NOT NULL
         );
     """)
+    # The query scripts filter local_files by stash_file_id
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_local_files_stash_file_id ON local_files(stash_file_id);")
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS edl_files (
             edl_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -29,6 +99,8 @@ def create_local_db(conn):
             ingested_at DATETIME NOT NULL
         );
     """)
+    # The by_edl query matches filenames case-insensitively
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_edl_files_filename_nc ON edl_files(filename COLLATE NOCASE);")
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS edl_records (
             record_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -41,6 +113,10 @@ def create_local_db(conn):
             UNIQUE(edl_id, local_file_id, start_time_ms, length_ms)
         );
     """)
+    # The UNIQUE index leads with edl_id; joins from local_files and the stale-record
+    # cleanup look records up by local_file_id
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_edl_records_local_file_id ON edl_records(local_file_id);")
+    create_edl_files_fts(cursor)
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS edl_metadata (
             edl_id INTEGER PRIMARY KEY,
@@ -63,127 +139,313 @@ def create_local_db(conn):
     """)
     conn.commit()
 
-# ----------------------------------------------------------------------------------------------------------------------
-# UTILITY FUNCTIONS
-# ----------------------------------------------------------------------------------------------------------------------
-
-def get_stash_files(stash_db_path):
+def create_edl_files_fts(cursor):
     """
-    Reads all file paths and IDs from the stash.db and returns them as a dictionary.
+    Adds a trigram FTS5 index over edl_files.filename, kept current by triggers, so
+    the by_edl '%name%' LIKE patterns are answered from the index rather than by
+    scanning edl_files. Nothing is created when the SQLite build lacks FTS5.
     """
-    stash_files = {}
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'edl_files_fts';")
+    if cursor.fetchone():
+        return
+
     try:
-        conn = sqlite3.connect(stash_db_path)
-        cursor = conn.cursor()
         cursor.execute("""
-            SELECT f.id, fl.path || '/' || f.basename
-            FROM files f
-            JOIN folders fl ON f.parent_folder_id = fl.id;
+            CREATE VIRTUAL TABLE edl_files_fts USING fts5(
+                filename, content='edl_files', content_rowid='edl_id', tokenize='trigram'
+            );
         """)
-        rows = cursor.fetchall()
-        for stash_id, full_path in rows:
-            # os.path.normpath is crucial for matching
-            stash_files[os.path.normpath(full_path)] = stash_id
-        conn.close()
-    except sqlite3.Error as e:
-        print(f"Error reading Stash DB: {e}")
-        return None
-    return stash_files
+    except sqlite3.OperationalError:
+        return
 
-def get_file_count(filesystem_path, extensions):
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS edl_files_fts_insert AFTER INSERT ON edl_files BEGIN
+            INSERT INTO edl_files_fts (rowid, filename) VALUES (new.edl_id, new.filename);
+        END;
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS edl_files_fts_delete AFTER DELETE ON edl_files BEGIN
+            INSERT INTO edl_files_fts (edl_files_fts, rowid, filename) VALUES ('delete', old.edl_id, old.filename);
+        END;
+    """)
+    # Index the EDL files ingested before the FTS table existed
+    cursor.execute("INSERT INTO edl_files_fts (edl_files_fts) VALUES ('rebuild');")
+
+def is_utf8_path(path):
     """
-    Counts the number of files with specified extensions in the directory tree.
+    True if path can be bound as SQLite text. os.scandir hands back a name that is not
+    valid UTF-8 as a surrogate-escaped str, which sqlite3 refuses to encode.
     """
-    count = 0
-    for dirpath, dirnames, filenames in os.walk(filesystem_path):
-        for filename in filenames:
-            if filename.lower().endswith(tuple(extensions)):
-                count += 1
-    return count
+    if path.isascii():
+        return True
+    try:
+        path.encode()
+    except UnicodeEncodeError:
+        return False
+    return True
+
+def attach_stash(conn, stash_db_path):
+    """
+    Attaches stash.db read-only as the 'stash' schema and gives it its own page
+    cache. The connection must be opened with uri=True for the URI to be honored.
+    """
+    stash_uri = f"file:{pathname2url(os.path.abspath(stash_db_path))}?mode=ro"
+    conn.execute("ATTACH DATABASE ? AS stash", (stash_uri,))
+    conn.execute(f"PRAGMA stash.cache_size={STASH_CACHE_SIZE};")
+
+def create_file_path_index(cursor):
+    """
+    Builds the unique index on local_files.file_path once, after a bulk load.
+    Databases created while file_path carried a UNIQUE constraint already have
+    an equivalent autoindex, so nothing is added for them.
+    """
+    cursor.execute("PRAGMA index_list(local_files);")
+    if not any(row[2] for row in cursor.fetchall()):
+        cursor.execute("CREATE UNIQUE INDEX idx_local_files_path ON local_files(file_path);")
 
 # ----------------------------------------------------------------------------------------------------------------------
-# COMMANDS
+# UTILITY FUNCTIONS
 # ----------------------------------------------------------------------------------------------------------------------
 
-def sync_filesystem_with_stash(stash_db_path, local_db_path, filesystem_path, rebuild=False):
+def iter_matching_files(root, extensions):
+    """
+    Yields the path of every file under root whose name ends with one of the given
+    extensions. Uses os.scandir directly so the d_type returned by the directory read
+    answers is_dir() without a stat per entry. extensions must be a tuple of lowercase
+    suffixes. Unreadable directories are skipped, as os.walk does by default.
     """
-    Scans the filesystem, verifies against stash.db, populates a database,
-    and handles incremental updates or full rebuilds.
+    stack = [root]
+    while stack:
+        dirpath = stack.pop()
+        try:
+            with os.scandir(dirpath) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(extensions):
+                        yield entry.path
+        except OSError:
+            continue
+
+def iter_matching_files_parallel(root, extensions, max_workers=None):
     """
-    MEDIA_EXTENSIONS = {'.mp4', '.mkv', '.avi', '.mov', '.wmv', 'webm', '.flv', '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.mp3', '.wav', '.flac', '.aac'}
+    Same results as iter_matching_files, but every top-level subdirectory of root is
+    walked by a worker thread. os.scandir releases the GIL while it reads a directory,
+    so the directory-read latency of the subtrees overlaps. Paths come back to the
+    caller through a bounded queue, so all database work stays on the calling thread.
+    """
+    if max_workers is None:
+        max_workers = min(32, (os.cpu_count() or 1) * 4)
 
+    subdirs = []
+    try:
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.name.lower().endswith(extensions):
+                    yield entry.path
+    except OSError:
+        return
+
+    results = queue.Queue(maxsize=WALK_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def walk_subtree(subdir):
+        try:
+            for path in iter_matching_files(subdir, extensions):
+                if stop.is_set():
+                    return
+                results.put(path)
+        finally:
+            # None marks this subtree as finished
+            results.put(None)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(walk_subtree, subdir) for subdir in subdirs]
+        remaining = len(futures)
+        try:
+            while remaining:
+                path = results.get()
+                if path is None:
+                    remaining -= 1
+                else:
+                    yield path
+            for future in futures:
+                future.result()
+        finally:
+            # If the caller stopped early, drain the queue so no worker stays blocked on put()
+            stop.set()
+            while remaining:
+                if results.get() is None:
+                    remaining -= 1
+
+# ----------------------------------------------------------------------------------------------------------------------
+# COMMANDS
+# ----------------------------------------------------------------------------------------------------------------------
+
+def sync_filesystem_with_stash(stash_db_path, local_db_path, filesystem_path, rebuild=False, workers=None):
+    """
+    Scans the filesystem, verifies against the attached stash.db, populates a
+    database, and handles incremental updates or full rebuilds.
+    """
     # 1. HANDLE REBUILD LOGIC
     if rebuild and os.path.exists(local_db_path):
         print(f"⚠️ Rebuild requested: Deleting existing local DB at '{local_db_path}'...")
         os.remove(local_db_path)
+        # A WAL left behind by the deleted database must not be replayed into the new one
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(local_db_path + suffix):
+                os.remove(local_db_path + suffix)
     
     # 2. SETUP DATABASE CONNECTION
-    local_conn = sqlite3.connect(local_db_path)
+    # isolation_level=None disables the implicit transaction handling so the
+    # whole scan can be wrapped in a single explicit BEGIN/COMMIT below.
+    local_conn = sqlite3.connect(local_db_path, isolation_level=None, uri=True, cached_statements=CACHED_STATEMENTS)
     create_local_db(local_conn)
+    if rebuild:
+        # The database was just created from scratch, so an interrupted rebuild is simply
+        # re-run; skip the journal and fsyncs for the bulk load. WAL is restored on the next open.
+        local_conn.executescript(REBUILD_DB_PRAGMAS)
     local_cursor = local_conn.cursor()
 
-    print("Reading file paths from stash.db...")
-    stash_files = get_stash_files(stash_db_path)
-    if stash_files is None:
+    # Stash is attached to the local connection so scanned paths are matched against
+    # its files/folders tables inside SQLite. The stash side is normalized with the
+    # same os.path.normpath the scan uses, registered as a SQL function.
+    local_conn.create_function("normpath", 1, os.path.normpath, deterministic=True)
+    try:
+        attach_stash(local_conn, stash_db_path)
+    except sqlite3.Error as e:
+        print(f"Error reading Stash DB: {e}")
         local_conn.close()
         return
 
     # 3. FILE SCANNING AND POPULATION LOGIC
-    total_files = get_file_count(filesystem_path, MEDIA_EXTENSIONS)
-    if total_files == 0:
-        print("No media files found to process.")
-        local_conn.close()
-        return
-
     missing_log_path = "/tmp/stash_missing_files.log"
     print(f"Scanning filesystem from {filesystem_path}...")
     print(f"Missing files will be logged to {missing_log_path}")
     
-    found_count = 0
-    missing_count = 0
     processed_count = 0
     
-    # New list to track and print new files
-    new_files_added = []
+    # Every scanned path is bulk-loaded into a temp table and the matched files are
+    # merged into local_files after the walk, so the file_path index is probed once
+    # per file at the end rather than updated on every insert.
+    local_cursor.execute("CREATE TEMP TABLE sync_scan (file_path TEXT PRIMARY KEY);")
+
+    # Rows waiting to be flushed to the scan table with a single executemany
+    pending = []
+
+    # Paths that are not valid UTF-8 cannot be staged (or match a Stash path), so they
+    # go straight to the missing-files log
+    undecodable_paths = []
+
+    # One transaction for the whole walk: N inserts share a single journal sync
+    local_conn.execute("BEGIN")
+
+    # Normalizing the root once is enough: scandir joins plain entry names onto it,
+    # so every entry.path below is already in normpath form.
+    for file_path in iter_matching_files_parallel(os.path.normpath(filesystem_path), MEDIA_EXTENSIONS, workers):
+        if is_utf8_path(file_path):
+            pending.append((file_path,))
+        else:
+            undecodable_paths.append(file_path)
+
+        if len(pending) >= INSERT_BATCH_SIZE:
+            local_cursor.executemany(INSERT_SCAN_SQL, pending)
+            pending.clear()
+        
+        processed_count += 1
+        if processed_count % PROGRESS_INTERVAL == 0:
+            sys.stdout.write(f'\rProcessed: {processed_count} files')
+            sys.stdout.flush()
+
+    sys.stdout.write(f'\rProcessed: {processed_count} files')
+    sys.stdout.flush()
+
+    if processed_count == 0:
+        print("\nNo media files found to process.")
+        local_conn.close()
+        return
 
-    with open(missing_log_path, 'w') as log_file:
-        log_file.write(f"--- Missing Files Report - {datetime.datetime.now()} ---\n\n")
+    if pending:
+        local_cursor.executemany(INSERT_SCAN_SQL, pending)
 
-        for dirpath, dirnames, filenames in os.walk(filesystem_path):
-            for filename in filenames:
-                if not filename.lower().endswith(tuple(MEDIA_EXTENSIONS)):
-                    continue
-                
-                full_path = os.path.normpath(os.path.join(dirpath, filename))
-                
-                if full_path in stash_files:
-                    stash_id = stash_files[full_path]
-                    try:
-                        # INSERT OR IGNORE is the core of the incremental update logic
-                        local_cursor.execute(
-                            """INSERT OR IGNORE INTO local_files (file_path, stash_file_id) 
-                            VALUES (?, ?)""",
-                            (full_path, stash_id)
-                        )
-                        
-                        # <<< MODIFICATION HERE >>>
-                        # sqlite3.cursor.rowcount is > 0 if a row was actually inserted
-                        if local_cursor.rowcount > 0:
-                            found_count += 1
-                            new_files_added.append(full_path) 
-                        
-                    except sqlite3.Error as e:
-                        print(f"\n[DB ERROR] Failed to process {full_path}: {e}")
-                else:
-                    log_file.write(f"{full_path}\n")
-                    missing_count += 1
-                
-                processed_count += 1
-                percentage = (processed_count / total_files) * 100
-                sys.stdout.write(f'\rProgress: {percentage:.2f}% ({processed_count}/{total_files} files)')
-                sys.stdout.flush()
+    print("\nMatching scanned files against stash.db...")
+    try:
+        # The scan table is probed through its primary key once per stash file.
+        # OR REPLACE keeps the last stash id for a path, as the old dict lookup did.
+        # Only paths with a doubled or trailing slash or a dot component can change under normpath,
+        # so the Python callback is skipped for the (usual) already-clean rows.
+        local_cursor.execute("""
+            CREATE TEMP TABLE sync_matched (
+                file_path TEXT PRIMARY KEY,
+                stash_file_id INTEGER NOT NULL
+            );
+        """)
+        local_cursor.execute("""
+            INSERT OR REPLACE INTO sync_matched (file_path, stash_file_id)
+            SELECT s.file_path, sp.id
+            FROM (
+                SELECT f.id, fl.path || '/' || f.basename AS path
+                FROM stash.files f
+                JOIN stash.folders fl ON f.parent_folder_id = fl.id
+            ) sp
+            JOIN sync_scan s ON s.file_path = CASE
+                WHEN INSTR(sp.path, '//') OR INSTR(sp.path, '/.')
+                    OR SUBSTR(sp.path, 1, 1) = '.' OR SUBSTR(sp.path, -1) = '/'
+                THEN normpath(sp.path)
+                ELSE sp.path
+            END;
+        """)
+    except sqlite3.Error as e:
+        print(f"Error reading Stash DB: {e}")
+        local_conn.close()
+        return
+
+    local_cursor.execute("""
+        SELECT s.file_path
+        FROM sync_scan s
+        WHERE NOT EXISTS (SELECT 1 FROM sync_matched m WHERE m.file_path = s.file_path);
+    """)
+
+    # Stream the misses straight from the cursor into the buffered log instead of
+    # materializing them as a list first. The log is binary and each path goes through
+    # os.fsencode, which skips the text layer and writes the undecodable names from the
+    # walk back out as their original bytes.
+    missing_count = 0
+    with open(missing_log_path, 'wb', buffering=LOG_BUFFER_SIZE) as log_file:
+        log_file.write(f"--- Missing Files Report - {datetime.datetime.now()} ---\n\n".encode())
+        for full_path in undecodable_paths:
+            log_file.write(os.fsencode(full_path) + b"\n")
+            missing_count += 1
+        for (full_path,) in local_cursor:
+            log_file.write(os.fsencode(full_path) + b"\n")
+            missing_count += 1
+
+    # Matches that are not yet linked are the new files. The NOT EXISTS probe
+    # uses the file_path index on incremental runs and is trivial on an empty table.
+    local_cursor.execute("""
+        CREATE TEMP TABLE sync_new_files AS
+        SELECT m.file_path, m.stash_file_id
+        FROM sync_matched m
+        WHERE NOT EXISTS (SELECT 1 FROM local_files lf WHERE lf.file_path = m.file_path);
+    """)
+    local_cursor.execute("""
+        INSERT INTO local_files (file_path, stash_file_id)
+        SELECT file_path, stash_file_id FROM sync_new_files;
+    """)
+    create_file_path_index(local_cursor)
+
+    # New list to track and print new files
+    local_cursor.execute("SELECT file_path FROM sync_new_files;")
+    new_files_added = [row[0] for row in local_cursor.fetchall()]
+
+    # Refresh the planner statistics now that the bulk load is done, so the ingest
+    # phase's joins against local_files are planned from real row counts. Only the
+    # main schema is analyzed; stash.db is attached read-only.
+    local_cursor.execute("ANALYZE main;")
     
-    local_conn.commit()
+    local_conn.execute("COMMIT")
     local_conn.close()
     
     # 4. REPORTING NEW FILES
@@ -202,26 +464,143 @@ def sync_filesystem_with_stash(stash_db_path, local_db_path, filesystem_path, re
     print("="*50)
 
 
+def flush_edl_records(conn, pending_records, log_file):
+    """
+    Stages the buffered clips in a temp table and links them to local_files with a
+    single INSERT ... SELECT on the file_path index, logging clips whose media path
+    is not in the local DB. Clears the buffer and returns how many records were new.
+    """
+    if not pending_records:
+        return 0
+
+    conn.executemany(INSERT_EDL_STAGING_SQL, pending_records)
+    changes_before = conn.total_changes
+    try:
+        conn.execute(LINK_EDL_STAGING_SQL)
+    except sqlite3.Error as e:
+        log_file.write(f"\n[DB ERROR] Failed to insert a batch of {len(pending_records)} records: {e}\n")
+    added = conn.total_changes - changes_before
+
+    unmatched = conn.execute("""
+        SELECT s.edl_path, s.line_number, s.file_path
+        FROM temp.edl_staging s
+        WHERE NOT EXISTS (SELECT 1 FROM local_files lf WHERE lf.file_path = s.file_path)
+        ORDER BY s.rowid;
+    """)
+    for edl_path, line_number, file_path in unmatched:
+        log_file.write(f"[{edl_path}:{line_number}] File path not found in local DB: {file_path}\n")
+
+    conn.execute("DELETE FROM temp.edl_staging;")
+    pending_records.clear()
+    return added
+
+
+def is_edl_number(text):
+    """
+    True for the plain decimal times EDL clip lines carry, like '12' or '12.5'.
+    Signs, exponents and a leading or trailing dot are rejected, as the old line
+    regex did.
+    """
+    whole, dot, fraction = text.partition('.')
+    return whole.isdecimal() and (not dot or fraction.isdecimal())
+
+
+def parse_edl_file(full_edl_path):
+    """
+    Reads and parses one EDL file without touching the database, so several files
+    can be parsed by worker threads at once. Returns (header_ok, clips, log_lines)
+    where clips are (line_number, normalized_path, start_time_ms, length_ms) tuples
+    and log_lines are the error-log entries to write.
+    """
+    header_ok = False
+    clips = []
+    log_lines = []
+    try:
+        with open(full_edl_path, 'r', encoding='utf-8') as edl_file:
+            # The file is streamed line by line; the header is its first non-blank line
+            header_line = ''
+            header_line_number = 0
+            for header_line_number, raw_line in enumerate(edl_file, 1):
+                header_line = raw_line.strip()
+                if header_line:
+                    break
+
+            if not header_line:
+                log_lines.append(f"[{full_edl_path}] File is empty.\n")
+                return header_ok, clips, log_lines
+
+            if header_line != "# mpv EDL v0":
+                log_lines.append(f"[{full_edl_path}] Invalid header: '{header_line}'\n")
+                return header_ok, clips, log_lines
+
+            header_ok = True
+            for line_number, line in enumerate(edl_file, header_line_number + 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                
+                # path,start,length: split from the right so commas in the path survive
+                parts = line.rsplit(',', 2)
+                if len(parts) == 3 and is_edl_number(parts[1]) and is_edl_number(parts[2]):
+                    file_path, start_time_s, length_s = parts
+                    normalized_path = os.path.normpath(file_path)
+                    
+                    start_time_ms = float(start_time_s) * 1000
+                    length_ms = float(length_s) * 1000
+                    clips.append((line_number, normalized_path, start_time_ms, length_ms))
+                else:
+                    log_lines.append(f"[{full_edl_path}:{line_number}] Unparsed line: {line}\n")
+
+    except Exception as e:
+        # A file that fails part way through (e.g. a decode error) is skipped whole,
+        # as if it had been read in one go: no clips, and only the error is logged
+        return False, [], [f"Error processing EDL file {full_edl_path}: {e}\n"]
+
+    return header_ok, clips, log_lines
+
+def iter_parsed_edl_files(edl_paths, max_workers=EDL_PARSE_WORKERS):
+    """
+    Yields (edl_path, parse_edl_file result) in the order of edl_paths. Files are parsed
+    by worker threads at most 2 * max_workers ahead of the caller, so only that many
+    parsed clip lists are held in memory at once, however many EDL files there are.
+    """
+    window = 2 * max_workers
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        in_flight = deque()
+        for edl_path in edl_paths:
+            in_flight.append((edl_path, executor.submit(parse_edl_file, edl_path)))
+            if len(in_flight) >= window:
+                done_path, future = in_flight.popleft()
+                yield done_path, future.result()
+
+        while in_flight:
+            done_path, future = in_flight.popleft()
+            yield done_path, future.result()
+
+
 def ingest_edl_files(local_db_path, edl_root_path):
     """
     Ingests EDL files, parsing records and populating the edl_records table.
     """
-    EDL_EXTENSIONS = {'.edl'}
-    
     if not os.path.exists(local_db_path):
         print(f"Error: Local database '{local_db_path}' not found. Please run the 'sync' command first.")
         sys.exit(1)
 
-    local_conn = sqlite3.connect(local_db_path)
+    local_conn = sqlite3.connect(local_db_path, cached_statements=CACHED_STATEMENTS)
+    # Brings databases created by older versions up to the current schema and indexes
+    create_local_db(local_conn)
     
-    # Pre-fetch lookup table for local files
-    local_file_lookup = {}
     local_cursor = local_conn.cursor()
-    local_cursor.execute("SELECT local_id, file_path FROM local_files;")
-    for local_id, file_path in local_cursor.fetchall():
-        local_file_lookup[os.path.normpath(file_path)] = local_id
+    # Clip paths are resolved to local files by a join in SQL, probing this index
+    create_file_path_index(local_cursor)
+
+    # Pre-fetch the IDs of EDL files ingested on earlier runs
+    local_cursor.execute("SELECT filename, edl_id FROM edl_files;")
+    edl_id_by_filename = dict(local_cursor.fetchall())
 
-    total_edl_files = get_file_count(edl_root_path, EDL_EXTENSIONS)
+    # One walk: the paths are kept so the progress total needs no second pass
+    edl_paths = list(iter_matching_files(edl_root_path, EDL_EXTENSIONS))
+    total_edl_files = len(edl_paths)
     if total_edl_files == 0:
         print("No EDL files found to ingest.")
         return
@@ -233,93 +612,73 @@ def ingest_edl_files(local_db_path, edl_root_path):
     records_added_count = 0
     edl_files_processed = 0
 
-    with open(ingestion_log_path, 'w') as log_file:
-        log_file.write(f"--- EDL Ingestion Error Report - {datetime.datetime.now()} ---\n\n")
+    # Parsed clips waiting to be staged and linked to local_files in one batch. Sync only
+    # stores normalized paths, so the normalized clip paths can be joined on directly.
+    local_cursor.execute("""
+        CREATE TEMP TABLE edl_staging (
+            edl_path TEXT NOT NULL,
+            line_number INTEGER NOT NULL,
+            edl_id INTEGER NOT NULL,
+            file_path TEXT NOT NULL,
+            start_time_ms REAL NOT NULL,
+            length_ms REAL NOT NULL
+        );
+    """)
+    pending_records = []
 
-        for dirpath, dirnames, filenames in os.walk(edl_root_path):
-            for filename in filenames:
-                if not filename.lower().endswith(tuple(EDL_EXTENSIONS)):
-                    continue
+    # One write transaction for the whole ingest, taken up front so a concurrent
+    # writer fails here rather than part way through
+    local_conn.execute("BEGIN IMMEDIATE")
 
-                full_edl_path = os.path.join(dirpath, filename)
-                try:
-                    with open(full_edl_path, 'r', encoding='utf-8') as edl_file:
-                        file_contents = edl_file.read().strip()
-                        lines = file_contents.splitlines()
-
-                        if not lines:
-                            log_file.write(f"[{full_edl_path}] File is empty.\n")
-                            continue
-
-                        header_line = lines[0].strip()
-                        if header_line != "# mpv EDL v0":
-                            log_file.write(f"[{full_edl_path}] Invalid header: '{header_line}'\n")
-                            continue
-
-                        # --- EDL File and Metadata Handling (Incremental) ---
-                        filename_norm = filename
-                        style_name = re.sub(r'_chopped\d-\d$', '', os.path.splitext(filename)[0])
-                        
-                        # Use INSERT OR IGNORE for the EDL file to prevent duplicates
-                        local_cursor.execute(
-                            """INSERT OR IGNORE INTO edl_files (filename, ingested_at) 
-                            VALUES (?, ?)""",
-                            (filename_norm, datetime.datetime.now())
-                        )
-                        
-                        # Get the ID (whether inserted or already existing)
-                        local_cursor.execute(
-                            "SELECT edl_id FROM edl_files WHERE filename = ?", (filename_norm,)
-                        )
-                        edl_id = local_cursor.fetchone()[0]
-
-                        # Use INSERT OR IGNORE for metadata
-                        local_cursor.execute(
-                            """INSERT OR IGNORE INTO edl_metadata (edl_id, style) 
-                            VALUES (?, ?)""",
-                            (edl_id, style_name)
-                        )
-                        # --- End EDL File and Metadata Handling ---
-
-                        for line_number, line in enumerate(lines[1:], 2):
-                            line = line.strip()
-                            if not line or line.startswith('#'):
-                                continue
-                            
-                            match = re.match(r'^(.*),(\d+(?:\.\d+)?),(\d+(?:\.\d+)?)$', line)
-                            if match:
-                                file_path, start_time_s, length_s = match.groups()
-                                normalized_path = os.path.normpath(file_path)
-                                
-                                if normalized_path in local_file_lookup:
-                                    local_id = local_file_lookup[normalized_path]
-                                    start_time_ms = float(start_time_s) * 1000
-                                    length_ms = float(length_s) * 1000
-                                    
-                                    try:
-                                        # INSERT OR IGNORE is the core of the incremental update logic here too
-                                        local_cursor.execute(
-                                            """INSERT OR IGNORE INTO edl_records (edl_id, local_file_id, start_time_ms, length_ms) 
-                                            VALUES (?, ?, ?, ?)""",
-                                            (edl_id, local_id, start_time_ms, length_ms)
-                                        )
-                                        if local_cursor.rowcount > 0:
-                                            records_added_count += 1
-                                    except sqlite3.Error as e:
-                                        log_file.write(f"\n[DB ERROR] Failed to insert record in {filename_norm} line {line_number}: {e}")
-                                else:
-                                    log_file.write(f"[{full_edl_path}:{line_number}] File path not found in local DB: {normalized_path}\n")
-                            else:
-                                log_file.write(f"[{full_edl_path}:{line_number}] Unparsed line: {line}\n")
-
-                except Exception as e:
-                    log_file.write(f"Error processing EDL file {full_edl_path}: {e}\n")
-                
-                edl_files_processed += 1
+    with open(ingestion_log_path, 'w', buffering=LOG_BUFFER_SIZE) as log_file:
+        log_file.write(f"--- EDL Ingestion Error Report - {datetime.datetime.now()} ---\n\n")
+
+        # Files are read and parsed by worker threads a bounded window ahead; this thread
+        # alone writes to SQLite. Results come back in walk order, so EDL IDs are
+        # assigned deterministically.
+        for full_edl_path, (header_ok, clips, log_lines) in iter_parsed_edl_files(edl_paths):
+            log_file.writelines(log_lines)
+
+            if header_ok:
+                # --- EDL File and Metadata Handling (Incremental) ---
+                filename_norm = os.path.basename(full_edl_path)
+                style_name = CHOPPED_SUFFIX_RE.sub('', os.path.splitext(filename_norm)[0])
+
+                # Known EDL files come from the prefetched map; only a new one costs
+                # an INSERT, which hands back its ID through RETURNING
+                edl_id = edl_id_by_filename.get(filename_norm)
+                if edl_id is None:
+                    local_cursor.execute(INSERT_EDL_FILE_SQL, (filename_norm, datetime.datetime.now()))
+                    edl_id = local_cursor.fetchone()[0]
+                    edl_id_by_filename[filename_norm] = edl_id
+
+                    # Use INSERT OR IGNORE for metadata
+                    local_cursor.execute(INSERT_EDL_METADATA_SQL, (edl_id, style_name))
+                # --- End EDL File and Metadata Handling ---
+
+                pending_records.extend(
+                    (full_edl_path, line_number, edl_id, file_path, start_time_ms, length_ms)
+                    for line_number, file_path, start_time_ms, length_ms in clips
+                )
+
+            if len(pending_records) >= INSERT_BATCH_SIZE:
+                records_added_count += flush_edl_records(local_conn, pending_records, log_file)
+
+            edl_files_processed += 1
+            if edl_files_processed % PROGRESS_INTERVAL == 0:
                 percentage = (edl_files_processed / total_edl_files) * 100
                 sys.stdout.write(f'\rProgress: {percentage:.2f}% ({edl_files_processed}/{total_edl_files} files)')
                 sys.stdout.flush()
 
+        records_added_count += flush_edl_records(local_conn, pending_records, log_file)
+
+        percentage = (edl_files_processed / total_edl_files) * 100
+        sys.stdout.write(f'\rProgress: {percentage:.2f}% ({edl_files_processed}/{total_edl_files} files)')
+        sys.stdout.flush()
+
+    # Refresh the planner statistics after the bulk load for the query scripts
+    local_cursor.execute("ANALYZE main;")
+
     local_conn.commit()
     local_conn.close()
     
@@ -346,6 +705,11 @@ if __name__ == "__main__":
         action='store_true', 
         help="Completely delete and rebuild the local database file before syncing. Use only when necessary."
     )
+    sync_parser.add_argument(
+        '--workers',
+        type=int,
+        help="Number of directory-scanning threads (default: 4 per CPU, at most 32). Use 1 on a single spinning disk."
+    )
     
     # --- INGEST COMMAND ---
     ingest_parser = subparsers.add_parser('ingest', help='Ingest EDL files from a directory.')
@@ -364,7 +728,10 @@ if __name__ == "__main__":
         if not os.path.isdir(args.filesystem_root):
             print(f"Error: Filesystem root '{args.filesystem_root}' is not a valid directory.")
             sys.exit(1)
-        sync_filesystem_with_stash(stash_db_path, local_db_path, args.filesystem_root, args.rebuild)
+        if args.workers is not None and args.workers < 1:
+            print("Error: --workers must be at least 1.")
+            sys.exit(1)
+        sync_filesystem_with_stash(stash_db_path, local_db_path, args.filesystem_root, args.rebuild, args.workers)
     elif args.command == 'ingest':
         if not os.path.isdir(args.edl_root):
             print(f"Error: EDL root '{args.edl_root}' is not a valid directory.")
@@ -2,6 +2,31 @@ import sqlite3
 import os
 import sys
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+# Same connection settings the sync and ingest writers use on sync.db
+LOCAL_DB_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-65536;
+    PRAGMA mmap_size=268435456;
+"""
+
+# Threads issuing os.path.exists at once; each check is a stat that mostly waits on the disk
+EXISTS_CHECK_WORKERS = 64
+
+# Rows read from local_files per fetchmany and checked as one batch
+EXISTS_CHECK_CHUNK = 10000
+
+# Progress lines are only written every N files; a write+flush per file is a syscall per file
+PROGRESS_INTERVAL = 500
+
+def open_local_db(local_db_path):
+    """Opens the sync database with the shared PRAGMAs applied."""
+    conn = sqlite3.connect(local_db_path)
+    conn.executescript(LOCAL_DB_PRAGMAS)
+    return conn
 
 def check_filesystem_integrity(local_db_path):
     """
@@ -12,33 +37,53 @@ def check_filesystem_integrity(local_db_path):
         print(f"Error: Local database '{local_db_path}' not found. Cannot perform check.")
         return [], []
 
-    conn = sqlite3.connect(local_db_path)
+    conn = open_local_db(local_db_path)
     cursor = conn.cursor()
     
-    # Select local_id and file_path from the local_files table
-    cursor.execute("SELECT local_id, file_path FROM local_files;")
-    all_files = cursor.fetchall()
-    conn.close()
+    # Count first so the rows themselves can be streamed rather than fetched all at once
+    cursor.execute("SELECT COUNT(*) FROM local_files;")
+    total_count = cursor.fetchone()[0]
 
-    if not all_files:
+    if not total_count:
+        conn.close()
         print("Success: The local_files table is empty. Nothing to check.")
         return [], []
 
     missing_files = []
     missing_ids = []
     
-    total_count = len(all_files)
     print(f"Starting integrity check on {total_count} records in the database...")
 
-    for i, (local_id, file_path) in enumerate(all_files):
-        # Update progress counter (without newline)
-        sys.stdout.write(f'\rProgress: {i + 1}/{total_count} files checked.')
-        sys.stdout.flush()
+    # Select local_id and file_path from the local_files table
+    cursor.execute("SELECT local_id, file_path FROM local_files;")
+    checked_count = 0
+
+    # The stat calls are latency-bound, so they are issued from a thread pool, one
+    # chunk of rows at a time; map() hands the results back in row order
+    with ThreadPoolExecutor(max_workers=EXISTS_CHECK_WORKERS) as executor:
+        while True:
+            rows = cursor.fetchmany(EXISTS_CHECK_CHUNK)
+            if not rows:
+                break
+
+            exists_results = executor.map(os.path.exists, [file_path for _, file_path in rows])
+            for (local_id, file_path), exists in zip(rows, exists_results):
+                checked_count += 1
+                # Update progress counter (without newline)
+                if checked_count % PROGRESS_INTERVAL == 0:
+                    sys.stdout.write(f'\rProgress: {checked_count}/{total_count} files checked.')
+                    sys.stdout.flush()
+
+                # Check if the file exists on the filesystem
+                if not exists:
+                    missing_files.append(file_path)
+                    missing_ids.append(local_id)
 
-        # Check if the file exists on the filesystem
-        if not os.path.exists(file_path):
-            missing_files.append(file_path)
-            missing_ids.append(local_id)
+    conn.close()
+
+    # Always show the final count, whatever the interval left off at
+    sys.stdout.write(f'\rProgress: {checked_count}/{total_count} files checked.')
+    sys.stdout.flush()
 
     # Print a newline after the progress counter is done
     sys.stdout.write('\n')
@@ -55,20 +100,20 @@ def delete_stale_records(local_db_path, missing_ids):
         print("No records to delete.")
         return
 
-    conn = sqlite3.connect(local_db_path)
+    conn = open_local_db(local_db_path)
     cursor = conn.cursor()
     
-    # Convert list of IDs to a tuple for SQL IN clause
-    id_tuple = tuple(missing_ids)
+    # Load the IDs into a temp table so each DELETE is one indexed subquery, however
+    # many IDs there are (a ?-per-ID IN list runs into SQLITE_MAX_VARIABLE_NUMBER)
+    cursor.execute("CREATE TEMP TABLE del_ids (id INTEGER PRIMARY KEY);")
+    cursor.executemany("INSERT OR IGNORE INTO del_ids (id) VALUES (?);", ((local_id,) for local_id in missing_ids))
     
     # 1. Delete associated EDL records first (to satisfy foreign key constraints)
-    edl_delete_query = f"DELETE FROM edl_records WHERE local_file_id IN ({','.join(['?'] * len(id_tuple))})"
-    cursor.execute(edl_delete_query, id_tuple)
+    cursor.execute("DELETE FROM edl_records WHERE local_file_id IN (SELECT id FROM del_ids);")
     edl_records_deleted = cursor.rowcount
 
     # 2. Delete the primary local_files records
-    local_delete_query = f"DELETE FROM local_files WHERE local_id IN ({','.join(['?'] * len(id_tuple))})"
-    cursor.execute(local_delete_query, id_tuple)
+    cursor.execute("DELETE FROM local_files WHERE local_id IN (SELECT id FROM del_ids);")
     local_records_deleted = cursor.rowcount
     
     conn.commit()